@@ -0,0 +1,31 @@
+import orjson
+import sqlite3
+
+def open_chunk_db(db_path: str, check_same_thread: bool = True):
+    conn = sqlite3.connect(db_path, check_same_thread=check_same_thread)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS chunks (
+            id INTEGER PRIMARY KEY,
+            payload BLOB
+        )
+    """)
+    return conn
+
+def insert_chunks(conn, ids: list, chunks: list):
+    # Keyed by FAISS id; REPLACE overwrites rows orphaned by a crash before the index snapshot reused their ids
+    with conn:
+        conn.executemany(
+            "INSERT OR REPLACE INTO chunks (id, payload) VALUES (?, ?)",
+            [(chunk_id, orjson.dumps(chunk)) for chunk_id, chunk in zip(ids, chunks)]
+        )
+
+def fetch_chunks(conn, ids: list) -> dict:
+    if not ids:
+        return {}
+    rows = conn.execute(
+        f"SELECT id, payload FROM chunks WHERE id IN ({', '.join('?' * len(ids))})",
+        ids
+    )
+    return {chunk_id: orjson.loads(payload) for chunk_id, payload in rows}
@@ -0,0 +1,22 @@
+import sys
+import types
+
+# functions/ and config.py are deployed alongside the app but are not part of this repository.
+# Register placeholders so the webhook module can be imported; tests patch whatever they exercise.
+
+class _Placeholder:
+    def __init__(self, *args, **kwargs):
+        pass
+
+def _register(name, **attrs):
+    try:
+        __import__(name)
+    except ImportError:
+        module = types.ModuleType(name)
+        module.__dict__.update(attrs)
+        sys.modules[name] = module
+
+_register("functions", __path__=[])
+_register("functions.document_chunking", DocumentChunker=_Placeholder)
+_register("functions.embedding_model", EmbeddingModelFactory=_Placeholder)
+_register("config", CHUNKING_METHOD="recursive", EMBEDDING_MODEL_TYPE="default")
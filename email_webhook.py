@@ -1,41 +1,77 @@
-from fastapi import APIRouter, Request, BackgroundTasks
+from fastapi import APIRouter, Request
 from fastapi.responses import PlainTextResponse, JSONResponse
 import traceback
 import os
-import httpx
+import asyncio
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from dotenv import load_dotenv
-from msal import ConfidentialClientApplication
-from bs4 import BeautifulSoup
+from selectolax.lexbor import LexborHTMLParser
 import pytz
-import json
-from filelock import FileLock
+import msgspec
 
 from functions.document_chunking import DocumentChunker
 from functions.embedding_model import EmbeddingModelFactory
-from functions.vectorstore import VectorStore
+from index_writer import get_index_writer
+from graph_client import get_http_client, get_graph_token
+from metadata_store import open_metadata_db, insert_metadata
+from graph_models import GraphEmailMsg, NotificationCollection
 from config import CHUNKING_METHOD, EMBEDDING_MODEL_TYPE
 
 load_dotenv()
 
-AZURE_TENANT_ID = os.getenv("AZURE_TENANT_ID")
-AZURE_CLIENT_ID = os.getenv("AZURE_CLIENT_ID")
-AZURE_CLIENT_SECRET = os.getenv("AZURE_CLIENT_SECRET")
+# When set, embeddings come from this ONNX export instead of EmbeddingModelFactory
+EMBEDDING_ONNX_PATH = os.getenv("EMBEDDING_ONNX_PATH")
+EMBEDDING_TOKENIZER_PATH = os.getenv("EMBEDDING_TOKENIZER_PATH")
+
+BASE_PATH = "vector_stores/email_data"
+INDEX_PATH = os.path.join(BASE_PATH, "index_email_ids.faiss")
+LEGACY_INDEX_PATH = os.path.join(BASE_PATH, "index_email.faiss")
+CHUNK_DB_PATH = os.path.join(BASE_PATH, "chunks.db")
+METADATA_DB_PATH = os.path.join(BASE_PATH, "metadata.db")
+LEGACY_METADATA_PATH = os.path.join(BASE_PATH, "metadata.json")
+
+# Index writes are batched: flush after MAX_BATCH emails or MAX_WAIT_MS, whichever comes first
+MAX_BATCH = int(os.getenv("INDEX_MAX_BATCH", "32"))
+MAX_WAIT_MS = int(os.getenv("INDEX_MAX_WAIT_MS", "200"))
+# Metadata rows are committed right after each snapshot, so they never point at vectors that are not on disk yet
+INDEX_SNAPSHOT_SECONDS = int(os.getenv("INDEX_SNAPSHOT_SECONDS", "60"))
+
+# Upper bound on emails being fetched and chunked at once, shared across all notification batches
+MAX_INFLIGHT = int(os.getenv("MAX_INFLIGHT", "8"))
+
+index_queue = asyncio.Queue()
+inflight_limit = asyncio.Semaphore(MAX_INFLIGHT)
+pending_metadata = deque()
+persister_stop = asyncio.Event()
+notification_tasks = set()
+accepting_notifications = True
+
+# Built once in init_pipeline() at startup; model weights and chunker setup are too costly to redo per email
+embedding_model = None
+chunker = None
+# The batcher awaits one batch at a time, so a single dedicated thread is all the embedding ever needs
+embedding_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="embedding")
 
 router = APIRouter(prefix="/email", tags=["Email Webhook Processing"])
 
-async def get_graph_api_token():
-    authority = f"https://login.microsoftonline.com/{AZURE_TENANT_ID}"
-    scope = ["https://graph.microsoft.com/.default"]
-    app = ConfidentialClientApplication(
-        client_id=AZURE_CLIENT_ID,
-        authority=authority,
-        client_credential=AZURE_CLIENT_SECRET,
+def init_pipeline():
+    global embedding_model, chunker
+    if EMBEDDING_ONNX_PATH:
+        # Imported here so onnxruntime/tokenizers are only needed when the ONNX backend is selected
+        from onnx_embedding import OnnxEmbeddingModel
+        embedding_model = OnnxEmbeddingModel(EMBEDDING_ONNX_PATH, EMBEDDING_TOKENIZER_PATH)
+    else:
+        embedding_model = EmbeddingModelFactory.get_embedding_model(EMBEDDING_MODEL_TYPE)
+    chunker = DocumentChunker(
+        method=CHUNKING_METHOD,
+        source_type="email",
+        accessType="private"
     )
-    result = app.acquire_token_silent(scopes=scope, account=None)
-    if not result:
-        result = app.acquire_token_for_client(scopes=scope)
-    return result.get("access_token")
+
+async def get_graph_api_token():
+    return await get_graph_token()
 
 async def fetch_email_from_graph_api(resource: str):
     token = await get_graph_api_token()
@@ -44,21 +80,24 @@ async def fetch_email_from_graph_api(resource: str):
         return None
     graph_url = f"https://graph.microsoft.com/v1.0/{resource}"
     params = {
-        "$select": "id,subject,bodyPreview,body,from,toRecipients,ccRecipients,sentDateTime,internetMessageId,hasAttachments"
+        "$select": "id,subject,body,from,ccRecipients,sentDateTime,hasAttachments"
     }
-    headers = {"Authorization": f"Bearer {token}"}
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.get(graph_url, headers=headers, params=params)
-            response.raise_for_status()
-            return response.json()
-        except Exception as e:
-            print(f"[FETCH]  Error: {e}")
-            traceback.print_exc()
-            return None
+    headers = {
+        "Authorization": f"Bearer {token}",
+        # Ask Graph to render the body as plain text so HTML parsing is only a fallback
+        "Prefer": 'outlook.body-content-type="text"'
+    }
+    try:
+        response = await get_http_client().get(graph_url, headers=headers, params=params)
+        response.raise_for_status()
+        return msgspec.json.decode(response.content, type=GraphEmailMsg)
+    except Exception as e:
+        print(f"[FETCH]  Error: {e}")
+        traceback.print_exc()
+        return None
 
 @router.api_route("/graph-webhook", methods=["GET", "POST"])
-async def handle_graph_webhook(request: Request, background_tasks: BackgroundTasks):
+async def handle_graph_webhook(request: Request):
     validation_token = request.query_params.get("validationToken")
     if validation_token:
         local_time = datetime.now(pytz.timezone("Asia/Kolkata")).strftime("%Y-%m-%d %H:%M:%S")
@@ -67,15 +106,19 @@ async def handle_graph_webhook(request: Request, background_tasks: BackgroundTas
         return PlainTextResponse(content=validation_token, status_code=200)
 
     if request.method == "POST":
+        if not accepting_notifications:
+            # Without a 202, Graph redelivers the notification once the app is back up
+            return PlainTextResponse(content="Shutting down", status_code=503)
         try:
-            body = await request.json()
+            body = msgspec.json.decode(await request.body(), type=NotificationCollection)
             print("New email notification received:")
             print(body)
-            notifications = body.get("value", [])
-            for notification in notifications:
-                resource = notification.get("resource", "")
+            resources = [notification.resource for notification in body.value]
+            for resource in resources:
                 print(f"Resource: {resource}")
-                background_tasks.add_task(trigger_email_processing, resource)
+            task = asyncio.create_task(process_notifications(resources))
+            notification_tasks.add(task)
+            task.add_done_callback(notification_tasks.discard)
             return JSONResponse(content={"status": "Notification received"}, status_code=202)
         except Exception as e:
             print(f"Failed to parse JSON: {e}")
@@ -83,6 +126,26 @@ async def handle_graph_webhook(request: Request, background_tasks: BackgroundTas
 
     return PlainTextResponse(status_code=405)
 
+async def drain_pipeline():
+    global accepting_notifications
+    accepting_notifications = False
+    if notification_tasks:
+        await asyncio.gather(*notification_tasks, return_exceptions=True)
+    await index_queue.join()
+
+async def process_notifications(resources: list):
+    results = await asyncio.gather(
+        *[bounded_email_processing(resource) for resource in resources],
+        return_exceptions=True
+    )
+    for resource, result in zip(resources, results):
+        if isinstance(result, Exception):
+            print(f"[BACKGROUND]  Processing failed for {resource}: {result}")
+
+async def bounded_email_processing(resource: str):
+    async with inflight_limit:
+        await trigger_email_processing(resource)
+
 async def trigger_email_processing(resource: str):
     email_data = await fetch_email_from_graph_api(resource)
     if email_data:
@@ -90,17 +153,20 @@ async def trigger_email_processing(resource: str):
     else:
         print("[BACKGROUND]  Email not fetched.")
 
-async def process_and_store_email(email_data: dict):
-    uid = email_data.get("id")
-    subject = email_data.get("subject", "No Subject")
-    sender = email_data.get("from", {}).get("emailAddress", {}).get("address", "unknown")
-    sender_name = email_data.get("from", {}).get("emailAddress", {}).get("name", "Unknown")
-    sent_time = email_data.get("sentDateTime", "unknown")
-    cc_list = [r.get("emailAddress", {}).get("address", "") for r in email_data.get("ccRecipients", [])]
-    has_attachments = email_data.get("hasAttachments", False)
+async def process_and_store_email(email_data: GraphEmailMsg):
+    uid = email_data.id
+    subject = email_data.subject
+    sender = email_data.from_.emailAddress.address or "unknown"
+    sender_name = email_data.from_.emailAddress.name or "Unknown"
+    sent_time = email_data.sentDateTime
+    cc_list = [r.emailAddress.address for r in email_data.ccRecipients if r.emailAddress.address]
+    has_attachments = email_data.hasAttachments
 
-    html_body = email_data.get("body", {}).get("content", "")
-    plain_body = BeautifulSoup(html_body, "html.parser").get_text()
+    body_content = email_data.body.content or ""
+    if email_data.body.contentType == "text":
+        plain_body = body_content
+    else:
+        plain_body = html_to_text(body_content)
 
     if not plain_body.strip():
         print(f"[PROCESS EMAIL]  Email {uid} has no body content. Skipping.")
@@ -108,40 +174,21 @@ async def process_and_store_email(email_data: dict):
 
     print(f"[PROCESS EMAIL]  Storing {uid} from {sender} | Subject: {subject}")
 
-    base_path = "vector_stores/email_data"
-    os.makedirs(base_path, exist_ok=True)
-
     timestamp = datetime.utcnow().strftime('%Y%m%d_%H%M%S')
-    temp_file_path = os.path.join(base_path, f"email_{uid}_{timestamp}.txt")
-    index_path = os.path.join(base_path, "index_email.faiss")
-    metadata_path = os.path.join(base_path, "metadata.json")
-    metadata_lock_path = os.path.join(base_path, "metadata.json.lock")
 
-    with open(temp_file_path, "w", encoding="utf-8") as f:
-        f.write(plain_body)
-
-    chunker = DocumentChunker(
-        file_path=temp_file_path,
-        method=CHUNKING_METHOD,
-        source_type="email",
-        accessType="private"
-    )
-    chunks = await chunker.chunk()
+    chunks = await chunker.chunk(text=plain_body)
 
+    enrichment = {
+        "email_id": uid,
+        "subject": subject,
+        "sender": sender,
+        "sender_name": sender_name,
+        "timestamp": timestamp,
+        "cc": cc_list,
+        "hasAttachments": has_attachments
+    }
     for chunk in chunks:
-        chunk["metadata"].update({
-            "email_id": uid,
-            "subject": subject,
-            "sender": sender,
-            "sender_name": sender_name,
-            "timestamp": timestamp,
-            "cc": cc_list,
-            "hasAttachments": has_attachments
-        })
-
-    embedding_model = EmbeddingModelFactory.get_embedding_model(EMBEDDING_MODEL_TYPE)
-    vector_store = VectorStore(embedding_model, EMBEDDING_MODEL_TYPE)
-    vector_store.build_or_append_index(chunks, index_path)
+        chunk["metadata"].update(enrichment)
 
     metadata_entry = {
         "email_id": uid,
@@ -152,26 +199,106 @@ async def process_and_store_email(email_data: dict):
         "cc": cc_list,
         "hasAttachments": has_attachments,
         "chunk_count": len(chunks),
-        "index_path": index_path,
+        "index_path": INDEX_PATH,
         "uploadDate": datetime.utcnow().isoformat()
     }
 
-    lock = FileLock(metadata_lock_path)
-    with lock:
-        metadata_list = []
-        if os.path.exists(metadata_path):
-            with open(metadata_path, "r") as f:
-                try:
-                    metadata_list = json.load(f)
-                except json.JSONDecodeError:
-                    metadata_list = []
-
-        if not any(m.get("email_id") == uid for m in metadata_list):
-            metadata_list.append(metadata_entry)
-            with open(metadata_path, "w") as f:
-                json.dump(metadata_list, f, indent=4)
-        else:
-            print(f"[PROCESS EMAIL]  Duplicate email ID {uid} found. Skipping metadata append.")
-
-    os.remove(temp_file_path)
-    print(f"[PROCESS EMAIL]  Email {uid} stored successfully.")
+    await index_queue.put((chunks, metadata_entry))
+    print(f"[PROCESS EMAIL]  Email {uid} queued for indexing.")
+
+def html_to_text(html: str) -> str:
+    if not html:
+        return ""
+    tree = LexborHTMLParser(html)
+    # Documents such as <frameset> pages have no <body>; fall back to the whole tree
+    node = tree.body if tree.body is not None else tree.root
+    return node.text(separator=" ") if node is not None else ""
+
+async def run_index_batcher():
+    loop = asyncio.get_running_loop()
+    print("[INDEX BATCHER]  Started.")
+    while True:
+        batch = [await index_queue.get()]
+        deadline = loop.time() + MAX_WAIT_MS / 1000
+        while len(batch) < MAX_BATCH:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(index_queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+
+        try:
+            await store_batch_with_retry(batch)
+        finally:
+            for _ in batch:
+                index_queue.task_done()
+
+async def store_batch_with_retry(batch: list):
+    try:
+        await store_batch(batch)
+        return
+    except Exception as e:
+        print(f"[INDEX BATCHER]  Batch of {len(batch)} email(s) failed: {e}")
+        traceback.print_exc()
+        if len(batch) == 1:
+            print(f"[INDEX BATCHER]  Email {batch[0][1]['email_id']} was not stored.")
+            return
+
+    # Retry one email at a time so a single bad email does not cost the whole batch
+    for item in batch:
+        try:
+            await store_batch([item])
+        except Exception as e:
+            print(f"[INDEX BATCHER]  Email {item[1]['email_id']} was not stored: {e}")
+
+async def store_batch(batch: list):
+    loop = asyncio.get_running_loop()
+    all_chunks = [chunk for chunks, _ in batch for chunk in chunks]
+
+    if all_chunks:
+        vectors = await loop.run_in_executor(
+            embedding_executor, embedding_model.embed_documents, [chunk["content"] for chunk in all_chunks]
+        )
+        await asyncio.to_thread(get_index_writer().add, vectors, all_chunks)
+
+    pending_metadata.extend(metadata_entry for _, metadata_entry in batch)
+    print(f"[INDEX BATCHER]  Stored {len(batch)} email(s), {len(all_chunks)} chunk(s).")
+
+async def run_index_persister():
+    os.makedirs(BASE_PATH, exist_ok=True)
+    metadata_db = open_metadata_db(METADATA_DB_PATH, LEGACY_METADATA_PATH, check_same_thread=False)
+    print("[INDEX PERSISTER]  Started.")
+    try:
+        while not persister_stop.is_set():
+            try:
+                await asyncio.wait_for(persister_stop.wait(), INDEX_SNAPSHOT_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            await persist_index(metadata_db)
+    finally:
+        metadata_db.close()
+
+async def stop_index_persister(task: asyncio.Task):
+    # Waking the loop instead of cancelling it lets the final snapshot and metadata commit run to completion
+    persister_stop.set()
+    await task
+
+async def persist_index(metadata_db):
+    # Taken before the snapshot: every entry here was queued after its vectors were added to the index
+    entries = list(pending_metadata)
+    pending_metadata.clear()
+    try:
+        await asyncio.to_thread(get_index_writer().snapshot)
+        inserted = await asyncio.to_thread(insert_metadata, metadata_db, entries) if entries else 0
+    except Exception as e:
+        pending_metadata.extendleft(reversed(entries))
+        print(f"[INDEX PERSISTER]  Error: {e}")
+        traceback.print_exc()
+        return
+
+    if inserted < len(entries):
+        print(f"[INDEX PERSISTER]  {len(entries) - inserted} duplicate email ID(s) found. Skipping metadata append.")
+    if entries:
+        print(f"[INDEX PERSISTER]  Wrote {inserted} metadata row(s).")
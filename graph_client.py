@@ -0,0 +1,67 @@
+import os
+import time
+import asyncio
+from functools import lru_cache
+import httpx
+from msal import ConfidentialClientApplication
+
+GRAPH_SCOPE = ("https://graph.microsoft.com/.default",)
+
+_HTTP_CLIENT = None
+_TOKEN_CACHE = {}
+_TOKEN_LOCK = asyncio.Lock()
+
+def open_http_client():
+    global _HTTP_CLIENT
+    if _HTTP_CLIENT is None:
+        _HTTP_CLIENT = httpx.AsyncClient(
+            http2=True,
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=50)
+        )
+    return _HTTP_CLIENT
+
+async def close_http_client():
+    global _HTTP_CLIENT
+    if _HTTP_CLIENT is not None:
+        await _HTTP_CLIENT.aclose()
+        _HTTP_CLIENT = None
+
+def get_http_client():
+    return _HTTP_CLIENT
+
+@lru_cache(maxsize=1)
+def get_msal_app():
+    # MSAL's token cache lives on the app instance, so it must be built once and reused
+    return ConfidentialClientApplication(
+        client_id=os.getenv("AZURE_CLIENT_ID"),
+        authority=f"https://login.microsoftonline.com/{os.getenv('AZURE_TENANT_ID')}",
+        client_credential=os.getenv("AZURE_CLIENT_SECRET"),
+    )
+
+def cached_graph_token(scopes: tuple = GRAPH_SCOPE):
+    cached = _TOKEN_CACHE.get(scopes)
+    if cached and time.time() < cached[1] - 60:
+        return cached[0]
+    return None
+
+def acquire_graph_token(scopes: tuple = GRAPH_SCOPE):
+    # Blocking: MSAL performs the token request over HTTP on the calling thread
+    app = get_msal_app()
+    result = app.acquire_token_silent(scopes=list(scopes), account=None)
+    if not result:
+        result = app.acquire_token_for_client(scopes=list(scopes))
+    token = result.get("access_token")
+    if token:
+        _TOKEN_CACHE[scopes] = (token, time.time() + result.get("expires_in", 0))
+    return token
+
+async def get_graph_token(scopes: tuple = GRAPH_SCOPE):
+    token = cached_graph_token(scopes)
+    if token:
+        return token
+    # Concurrent callers wait for the one refresh in flight instead of each starting their own
+    async with _TOKEN_LOCK:
+        token = cached_graph_token(scopes)
+        if token:
+            return token
+        return await asyncio.to_thread(acquire_graph_token, scopes)
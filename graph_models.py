@@ -0,0 +1,30 @@
+from typing import List, Optional
+import msgspec
+
+# Typed shapes of the Graph payloads we consume; unknown fields are ignored, missing ones take the defaults below
+
+class EmailAddress(msgspec.Struct):
+    address: Optional[str] = None
+    name: Optional[str] = None
+
+class Recipient(msgspec.Struct):
+    emailAddress: EmailAddress = msgspec.field(default_factory=EmailAddress)
+
+class ItemBody(msgspec.Struct):
+    contentType: str = "html"
+    content: Optional[str] = ""
+
+class GraphEmailMsg(msgspec.Struct):
+    id: str
+    subject: Optional[str] = "No Subject"
+    body: ItemBody = msgspec.field(default_factory=ItemBody)
+    from_: Recipient = msgspec.field(name="from", default_factory=Recipient)
+    ccRecipients: List[Recipient] = []
+    sentDateTime: Optional[str] = "unknown"
+    hasAttachments: bool = False
+
+class ChangeNotification(msgspec.Struct):
+    resource: str = ""
+
+class NotificationCollection(msgspec.Struct):
+    value: List[ChangeNotification] = []
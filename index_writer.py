@@ -0,0 +1,158 @@
+import os
+import math
+import threading
+import numpy as np
+import faiss
+from dotenv import load_dotenv
+
+from chunk_store import open_chunk_db, insert_chunks, fetch_chunks
+
+load_dotenv()
+
+# Below IVF_THRESHOLD vectors are kept as exact float32 (IndexFlatIP). Past it, the index is rebuilt as IVF
+# with nlist=sqrt(N) and INT8 codes, both trained on those original floats rather than on a first small batch
+IVF_THRESHOLD = int(os.getenv("IVF_THRESHOLD", "10000"))
+FAISS_NPROBE = int(os.getenv("FAISS_NPROBE", "8"))
+# FAISS does not allow concurrent add/search: searches hit a read-only clone that is refreshed every INDEX_SWAP_ADDS vectors
+INDEX_SWAP_ADDS = int(os.getenv("INDEX_SWAP_ADDS", "1000"))
+
+_INDEX_WRITER = None
+
+class IndexWriter:
+    """Owns the in-memory FAISS indexes: adds go to the background index (bg), searches read the foreground clone (fg)."""
+
+    def __init__(self, index_path: str, db_path: str):
+        self.index_path = index_path
+        os.makedirs(os.path.dirname(index_path), exist_ok=True)
+        # Chunk payloads live in SQLite keyed by FAISS id, so snapshots only persist the FAISS blob
+        self.db = open_chunk_db(db_path, check_same_thread=False)
+        self.db_lock = threading.Lock()
+        self.write_lock = threading.Lock()
+        self.read_lock = threading.RLock()
+        self.bg = None
+        self.fg = None
+        self.next_id = 0
+        self.pending_adds = 0
+        self.dirty = False
+        self.load()
+
+    def load(self):
+        if os.path.exists(self.index_path):
+            self.bg = faiss.read_index(self.index_path)
+            ivf = faiss.try_extract_index_ivf(self.bg)
+            if ivf is None and not isinstance(self.bg, faiss.IndexIDMap):
+                raise ValueError(
+                    f"{self.index_path} is a {type(self.bg).__name__} without stored ids; "
+                    "move it aside and re-ingest to rebuild the index"
+                )
+            if ivf is not None:
+                ivf.nprobe = FAISS_NPROBE
+            self.fg = faiss.clone_index(self.bg)
+            # Ids come from the index itself; chunk rows written after the last snapshot are overwritten on reuse
+            self.next_id = max_id(self.bg) + 1
+        total = self.bg.ntotal if self.bg is not None else 0
+        print(f"[INDEX WRITER]  Loaded {total} vectors from {self.index_path}")
+
+    def add(self, vectors, chunks: list):
+        if not chunks:
+            return
+        vectors = np.ascontiguousarray(vectors, dtype="float32")
+        faiss.normalize_L2(vectors)
+        with self.write_lock:
+            if self.bg is None:
+                self.bg = faiss.IndexIDMap(faiss.IndexFlatIP(vectors.shape[1]))
+            ids = np.arange(self.next_id, self.next_id + len(chunks), dtype="int64")
+            with self.db_lock:
+                insert_chunks(self.db, ids.tolist(), chunks)
+            self.bg.add_with_ids(vectors, ids)
+            self.next_id += len(chunks)
+            self.pending_adds += len(chunks)
+            self.dirty = True
+            if self.bg.ntotal >= IVF_THRESHOLD and faiss.try_extract_index_ivf(self.bg) is None:
+                self.bg = self.build_ivf(self.bg)
+            if self.pending_adds >= INDEX_SWAP_ADDS:
+                self._swap()
+
+    def swap(self):
+        with self.write_lock:
+            self._swap()
+
+    def _swap(self):
+        # Caller holds write_lock; searches only block for the pointer flip, not the clone
+        if self.bg is None or self.pending_adds == 0:
+            return
+        fg = faiss.clone_index(self.bg)
+        self.pending_adds = 0
+        with self.read_lock:
+            self.fg = fg
+
+    def build_ivf(self, flat_index):
+        n = flat_index.ntotal
+        # Exact for the float32 IndexFlatIP stage, so the quantizer ranges come from real vectors
+        vectors = flat_index.index.reconstruct_n(0, n)
+        ids = faiss.vector_to_array(flat_index.id_map).astype("int64")
+        nlist = int(math.sqrt(n))
+
+        quantizer = faiss.IndexFlatIP(flat_index.d)
+        ivf = faiss.IndexIVFScalarQuantizer(
+            quantizer, flat_index.d, nlist, faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_INNER_PRODUCT
+        )
+        ivf.train(vectors)
+        ivf.add_with_ids(vectors, ids)
+        ivf.nprobe = FAISS_NPROBE
+        print(f"[INDEX WRITER]  Switched to IVF index (nlist={nlist}) at {n} vectors.")
+        return ivf
+
+    def search(self, query_vectors, k: int = 5, nprobe: int = None):
+        query_vectors = np.ascontiguousarray(query_vectors, dtype="float32")
+        faiss.normalize_L2(query_vectors)
+        with self.read_lock:
+            if self.fg is None or self.fg.ntotal == 0:
+                return [[] for _ in range(len(query_vectors))]
+            if faiss.try_extract_index_ivf(self.fg) is not None:
+                params = faiss.SearchParametersIVF(nprobe=nprobe or FAISS_NPROBE)
+                scores, ids = self.fg.search(query_vectors, k, params=params)
+            else:
+                scores, ids = self.fg.search(query_vectors, k)
+
+        with self.db_lock:
+            chunks = fetch_chunks(self.db, sorted({i for row in ids.tolist() for i in row if i != -1}))
+        return [
+            [(chunks[i], float(score)) for score, i in zip(row_scores, row_ids) if i in chunks]
+            for row_scores, row_ids in zip(scores.tolist(), ids.tolist())
+        ]
+
+    def snapshot(self):
+        with self.write_lock:
+            if not self.dirty:
+                return
+            data = faiss.serialize_index(self.bg)
+            total = self.bg.ntotal
+            self.dirty = False
+
+        with open(self.index_path + ".tmp", "wb") as f:
+            f.write(data.tobytes())
+        os.replace(self.index_path + ".tmp", self.index_path)
+        print(f"[INDEX WRITER]  Snapshot written ({total} vectors).")
+
+def max_id(index) -> int:
+    if index.ntotal == 0:
+        return -1
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is None:
+        return int(faiss.vector_to_array(index.id_map).max())
+    best = -1
+    for list_no in range(ivf.nlist):
+        size = ivf.invlists.list_size(list_no)
+        if size:
+            best = max(best, int(faiss.rev_swig_ptr(ivf.invlists.get_ids(list_no), size).max()))
+    return best
+
+def start_index_writer(index_path: str, db_path: str):
+    global _INDEX_WRITER
+    if _INDEX_WRITER is None:
+        _INDEX_WRITER = IndexWriter(index_path, db_path)
+    return _INDEX_WRITER
+
+def get_index_writer():
+    return _INDEX_WRITER
@@ -1,14 +1,32 @@
+import os
+import asyncio
 from fastapi import FastAPI
-from email_webhook import router as email_router
+from email_webhook import (
+    router as email_router, init_pipeline, drain_pipeline, run_index_batcher, run_index_persister,
+    stop_index_persister, INDEX_PATH, LEGACY_INDEX_PATH, CHUNK_DB_PATH
+)
+from index_writer import start_index_writer
+from graph_client import open_http_client, close_http_client
 from subscription import start_scheduler
 import uvicorn
 
+INDEX_SWAP_SECONDS = int(os.getenv("INDEX_SWAP_SECONDS", "10"))
+
 app = FastAPI(
     title="Microsoft Graph Email Webhook",
     description="FastAPI app that listens to Outlook email events and processes them with chunking, embedding, and vector storage.",
     version="1.0.0"
 )
 
+async def run_every(seconds: int, func):
+    # Blocking index maintenance runs on a worker thread so the event loop keeps serving webhooks
+    while True:
+        await asyncio.sleep(seconds)
+        try:
+            await asyncio.to_thread(func)
+        except Exception as e:
+            print(f"[APP] Periodic task {func.__name__} failed: {e}")
+
 # Register the email webhook route
 app.include_router(email_router)
 
@@ -16,7 +34,28 @@ app.include_router(email_router)
 @app.on_event("startup")
 async def startup_event():
     print("\n[APP STARTUP] Initializing webhook subscription and scheduler...\n")
-    start_scheduler()
+    if os.path.exists(LEGACY_INDEX_PATH):
+        print(f"[APP STARTUP] WARNING: {LEGACY_INDEX_PATH} is no longer read; re-ingest its emails to move them into {INDEX_PATH}.")
+    open_http_client()
+    init_pipeline()
+    app.state.index_writer = start_index_writer(INDEX_PATH, CHUNK_DB_PATH)
+    app.state.index_batcher = asyncio.create_task(run_index_batcher())
+    app.state.subscription_scheduler = start_scheduler()
+    app.state.index_persister = asyncio.create_task(run_index_persister())
+    app.state.index_swap = asyncio.create_task(run_every(INDEX_SWAP_SECONDS, app.state.index_writer.swap))
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    print("\n[APP SHUTDOWN] Draining queued emails and writing final index snapshot...\n")
+    await drain_pipeline()
+    app.state.index_batcher.cancel()
+    await asyncio.gather(app.state.index_batcher, return_exceptions=True)
+    await stop_index_persister(app.state.index_persister)
+    periodic_tasks = (app.state.subscription_scheduler, app.state.index_swap)
+    for task in periodic_tasks:
+        task.cancel()
+    await asyncio.gather(*periodic_tasks, return_exceptions=True)
+    await close_http_client()
 
 if __name__ == "__main__":
     uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
@@ -0,0 +1,57 @@
+import os
+import orjson
+import sqlite3
+
+COLUMNS = (
+    "email_id", "subject", "sender", "sender_name", "timestamp",
+    "cc", "hasAttachments", "chunk_count", "index_path", "uploadDate"
+)
+
+def open_metadata_db(db_path: str, legacy_json_path: str = None, check_same_thread: bool = True):
+    conn = sqlite3.connect(db_path, check_same_thread=check_same_thread)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS metadata (
+            email_id TEXT PRIMARY KEY,
+            subject TEXT,
+            sender TEXT,
+            sender_name TEXT,
+            timestamp TEXT,
+            cc TEXT,
+            hasAttachments INTEGER,
+            chunk_count INTEGER,
+            index_path TEXT,
+            uploadDate TEXT
+        )
+    """)
+    if legacy_json_path and os.path.exists(legacy_json_path):
+        import_legacy_metadata(conn, legacy_json_path)
+    return conn
+
+def import_legacy_metadata(conn, json_path: str) -> int:
+    # Only runs against an empty table, so the import happens once and never resurrects deleted rows
+    if conn.execute("SELECT 1 FROM metadata LIMIT 1").fetchone():
+        return 0
+    with open(json_path, "rb") as f:
+        try:
+            entries = orjson.loads(f.read())
+        except orjson.JSONDecodeError:
+            print(f"[METADATA STORE]  {json_path} is not valid JSON. Skipping import.")
+            return 0
+    inserted = insert_metadata(conn, entries)
+    print(f"[METADATA STORE]  Imported {inserted} email(s) from {json_path}.")
+    return inserted
+
+def insert_metadata(conn, entries: list) -> int:
+    # The primary key does the duplicate check; already-stored email IDs are ignored
+    rows = [
+        tuple(orjson.dumps(entry.get(c)).decode() if c == "cc" else entry.get(c) for c in COLUMNS)
+        for entry in entries
+    ]
+    with conn:
+        cursor = conn.executemany(
+            f"INSERT OR IGNORE INTO metadata ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})",
+            rows
+        )
+    return cursor.rowcount
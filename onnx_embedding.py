@@ -0,0 +1,82 @@
+import os
+import numpy as np
+import onnxruntime as ort
+from tokenizers import Tokenizer
+from dotenv import load_dotenv
+
+load_dotenv()
+
+ONNX_BATCH_SIZE = int(os.getenv("ONNX_BATCH_SIZE", "64"))
+ONNX_MAX_LENGTH = int(os.getenv("ONNX_MAX_LENGTH", "512"))
+# Must match how the model was trained: "cls" for BGE, "mean" for E5 / sentence-transformers exports
+EMBEDDING_POOLING = os.getenv("EMBEDDING_POOLING", "mean")
+
+SUPPORTED_INPUTS = ("input_ids", "attention_mask", "token_type_ids")
+
+class OnnxEmbeddingModel:
+    """Sentence embeddings from an ONNX export (BGE/E5-style), served by ONNX Runtime with CLS or mean pooling."""
+
+    def __init__(self, model_path: str, tokenizer_path: str, pooling: str = EMBEDDING_POOLING):
+        if pooling not in ("cls", "mean"):
+            raise ValueError(f"Unsupported pooling {pooling!r}; expected 'cls' or 'mean'")
+        self.pooling = pooling
+        available = ort.get_available_providers()
+        providers = [p for p in ("CUDAExecutionProvider", "CPUExecutionProvider") if p in available]
+        self.session = ort.InferenceSession(model_path, providers=providers)
+        device = "cuda" if providers[0] == "CUDAExecutionProvider" else "cpu"
+
+        self.input_names = [i.name for i in self.session.get_inputs()]
+        unsupported = [name for name in self.input_names if name not in SUPPORTED_INPUTS]
+        if unsupported or "input_ids" not in self.input_names:
+            raise ValueError(
+                f"{model_path} takes inputs {self.input_names}; only {list(SUPPORTED_INPUTS)} "
+                "are supported and input_ids is required"
+            )
+
+        output = self.session.get_outputs()[0]
+        self.output_name = output.name
+        # [batch, hidden] exports already pool inside the graph; [batch, seq, hidden] still need pooling here
+        if len(output.shape) == 2:
+            self.pooled = True
+        elif len(output.shape) == 3:
+            self.pooled = False
+        else:
+            raise ValueError(f"{model_path} output {output.name} has shape {output.shape}; expected rank 2 or 3")
+
+        self.tokenizer = Tokenizer.from_file(tokenizer_path)
+        self.tokenizer.enable_padding()
+        self.tokenizer.enable_truncation(max_length=ONNX_MAX_LENGTH)
+        pooling_note = "pooled by the model" if self.pooled else f"{pooling} pooling"
+        print(f"[ONNX EMBEDDING]  Loaded {model_path} on {device} ({pooling_note})")
+
+    def embed_documents(self, texts: list):
+        if not texts:
+            return []
+        return np.vstack([
+            self.embed_batch(texts[i:i + ONNX_BATCH_SIZE])
+            for i in range(0, len(texts), ONNX_BATCH_SIZE)
+        ])
+
+    def embed_query(self, text: str):
+        return self.embed_batch([text])[0]
+
+    def embed_batch(self, texts: list):
+        encodings = self.tokenizer.encode_batch(texts)
+        input_ids = np.array([e.ids for e in encodings], dtype=np.int64)
+        attention_mask = np.array([e.attention_mask for e in encodings], dtype=np.int64)
+        feeds = {
+            "input_ids": input_ids,
+            "attention_mask": attention_mask,
+            "token_type_ids": np.zeros_like(input_ids),
+        }
+
+        hidden = self.session.run(
+            [self.output_name], {name: feeds[name] for name in self.input_names}
+        )[0]
+
+        if self.pooled:
+            return hidden
+        if self.pooling == "cls":
+            return hidden[:, 0]
+        mask = attention_mask[..., None].astype(np.float32)
+        return (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
@@ -1,9 +1,7 @@
 import os
-import requests
 from datetime import datetime, timedelta
-from apscheduler.schedulers.background import BackgroundScheduler
 from dotenv import load_dotenv
-from msal import ConfidentialClientApplication
+from graph_client import get_graph_token, get_http_client
 import asyncio
 
 load_dotenv()
@@ -13,29 +11,18 @@ CALLBACK_URL = os.getenv("WEBHOOK_CALLBACK_URL")
 USER_ID = os.getenv("TARGET_USER_ID")
 RESOURCE = f"users/{USER_ID}/mailFolders('Inbox')/messages"
 
+FAST_CHECK_SECONDS = 15
+RENEWAL_SECONDS = 40 * 3600 - 300
+
 current_subscription_id = None
 use_fast_scheduler = True
 
 async def get_access_token():
-    tenant_id = os.getenv("AZURE_TENANT_ID")
-    client_id = os.getenv("AZURE_CLIENT_ID")
-    client_secret = os.getenv("AZURE_CLIENT_SECRET")
-    authority = f"https://login.microsoftonline.com/{tenant_id}"
-
-    app = ConfidentialClientApplication(
-        client_id=client_id,
-        authority=authority,
-        client_credential=client_secret
-    )
-    scope = ["https://graph.microsoft.com/.default"]
-    result = app.acquire_token_silent(scopes=scope, account=None)
-    if not result:
-        result = app.acquire_token_for_client(scopes=scope)
-    return result.get("access_token")
+    return await get_graph_token()
 
 async def get_existing_subscription(token):
     global current_subscription_id
-    response = requests.get(
+    response = await get_http_client().get(
         f"{GRAPH_API_URL}/subscriptions",
         headers={"Authorization": f"Bearer {token}"}
     )
@@ -49,7 +36,7 @@ async def get_existing_subscription(token):
     return False
 
 async def delete_all_subscriptions(token):
-    response = requests.get(
+    response = await get_http_client().get(
         f"{GRAPH_API_URL}/subscriptions",
         headers={"Authorization": f"Bearer {token}"}
     )
@@ -57,13 +44,19 @@ async def delete_all_subscriptions(token):
         print("Could not fetch subscriptions:", response.text)
         return
 
-    for sub in response.json().get("value", []):
-        sub_id = sub.get("id")
-        del_resp = requests.delete(
+    sub_ids = [sub.get("id") for sub in response.json().get("value", [])]
+    del_resps = await asyncio.gather(*[
+        get_http_client().delete(
             f"{GRAPH_API_URL}/subscriptions/{sub_id}",
             headers={"Authorization": f"Bearer {token}"}
         )
-        if del_resp.status_code == 204:
+        for sub_id in sub_ids
+    ], return_exceptions=True)
+
+    for sub_id, del_resp in zip(sub_ids, del_resps):
+        if isinstance(del_resp, Exception):
+            print(f"Failed to delete subscription {sub_id}: {del_resp}")
+        elif del_resp.status_code == 204:
             print(f"Deleted subscription: {sub_id}")
         else:
             print(f"Failed to delete subscription {sub_id}: {del_resp.text}")
@@ -83,7 +76,7 @@ async def create_subscription(token):
     print("POST https://graph.microsoft.com/v1.0/subscriptions")
     print(body)
 
-    response = requests.post(
+    response = await get_http_client().post(
         f"{GRAPH_API_URL}/subscriptions",
         headers={"Authorization": f"Bearer {token}", "Content-Type": "application/json"},
         json=body
@@ -110,7 +103,7 @@ async def renew_subscription():
     expiration = (datetime.utcnow() + timedelta(hours=40)).isoformat() + "Z"
     patch_body = {"expirationDateTime": expiration}
 
-    response = requests.patch(
+    response = await get_http_client().patch(
         f"{GRAPH_API_URL}/subscriptions/{current_subscription_id}",
         headers={"Authorization": f"Bearer {token}", "Content-Type": "application/json"},
         json=patch_body
@@ -123,37 +116,37 @@ async def renew_subscription():
         print(f" Renewal failed for {current_subscription_id}: {response.text}")
         return False
 
-def start_scheduler():
-    scheduler = BackgroundScheduler()
-
-    def scheduled_check():
-        asyncio.run(run_scheduled_check())
-
-    async def run_scheduled_check():
-        global use_fast_scheduler
-        print("Running scheduled subscription check...")
-
-        if current_subscription_id:
-            success = await renew_subscription()
-            if success and use_fast_scheduler:
-                use_fast_scheduler = False
-                scheduler.remove_job("scheduled_check")
-                scheduler.add_job(scheduled_check, "interval", hours=40, id="scheduled_check")
-                print("Switched to 40-hour patching schedule.")
-            return
-
-        token = await get_access_token()
-        if not token:
-            print("Failed to get token for recovery.")
-            return
-
-        await delete_all_subscriptions(token)
-        created = await create_subscription(token)
-        if created:
-            print("Subscription recovery succeeded. Attempting initial patch...")
-            await renew_subscription()
-
-    # Start with fast 30-sec scheduler
-    scheduler.add_job(scheduled_check, "interval", seconds=15, id="scheduled_check")
-    scheduler.start()
+async def run_scheduled_check():
+    global use_fast_scheduler
+    print("Running scheduled subscription check...")
+
+    if current_subscription_id:
+        success = await renew_subscription()
+        if success and use_fast_scheduler:
+            use_fast_scheduler = False
+            print("Switched to 40-hour patching schedule.")
+        return
+
+    token = await get_access_token()
+    if not token:
+        print("Failed to get token for recovery.")
+        return
+
+    await delete_all_subscriptions(token)
+    created = await create_subscription(token)
+    if created:
+        print("Subscription recovery succeeded. Attempting initial patch...")
+        await renew_subscription()
+
+async def run_scheduler():
     print("Auto-renew scheduler started (every 15 seconds until first patch, then every 40 hours).")
+    while True:
+        # Renew 5 minutes before the 40-hour expiration set on the subscription
+        await asyncio.sleep(FAST_CHECK_SECONDS if use_fast_scheduler else RENEWAL_SECONDS)
+        try:
+            await run_scheduled_check()
+        except Exception as e:
+            print(f"Scheduled subscription check failed: {e}")
+
+def start_scheduler():
+    return asyncio.create_task(run_scheduler())
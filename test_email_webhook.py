@@ -0,0 +1,136 @@
+import asyncio
+import sqlite3
+from collections import deque
+
+import numpy as np
+import pytest
+
+import email_webhook
+import index_writer
+from index_writer import IndexWriter
+from metadata_store import open_metadata_db
+from graph_models import GraphEmailMsg, ItemBody
+
+def queued_email(email_id, chunk_texts):
+    chunks = [{"content": text, "metadata": {}} for text in chunk_texts]
+    return chunks, {"email_id": email_id, "chunk_count": len(chunks)}
+
+class RecordingEmbeddingModel:
+    calls = []
+
+    def embed_documents(self, texts):
+        if "bad" in texts:
+            raise ValueError("cannot embed")
+        RecordingEmbeddingModel.calls.append(list(texts))
+        return np.random.default_rng(len(texts)).normal(size=(len(texts), 8))
+
+@pytest.fixture(autouse=True)
+def isolated_store(tmp_path, monkeypatch):
+    RecordingEmbeddingModel.calls = []
+    monkeypatch.setattr(email_webhook, "embedding_model", RecordingEmbeddingModel())
+    monkeypatch.setattr(index_writer, "_INDEX_WRITER", IndexWriter(str(tmp_path / "index.faiss"), str(tmp_path / "chunks.db")))
+    monkeypatch.setattr(email_webhook, "BASE_PATH", str(tmp_path))
+    monkeypatch.setattr(email_webhook, "METADATA_DB_PATH", str(tmp_path / "metadata.db"))
+    monkeypatch.setattr(email_webhook, "LEGACY_METADATA_PATH", str(tmp_path / "metadata.json"))
+    monkeypatch.setattr(email_webhook, "accepting_notifications", True)
+    monkeypatch.setattr(email_webhook, "pending_metadata", deque())
+    monkeypatch.setattr(email_webhook, "persister_stop", asyncio.Event())
+    return tmp_path
+
+@pytest.fixture
+def metadata_db(isolated_store):
+    return open_metadata_db(str(isolated_store / "metadata.db"), check_same_thread=False)
+
+def pending_ids():
+    return [entry["email_id"] for entry in email_webhook.pending_metadata]
+
+def stored_ids(tmp_path):
+    conn = sqlite3.connect(tmp_path / "metadata.db")
+    return [row[0] for row in conn.execute("SELECT email_id FROM metadata ORDER BY rowid")]
+
+def test_batch_without_chunks_still_queues_metadata(isolated_store):
+    asyncio.run(email_webhook.store_batch_with_retry([queued_email("a", []), queued_email("b", [])]))
+
+    assert RecordingEmbeddingModel.calls == []
+    assert pending_ids() == ["a", "b"]
+
+def test_failed_batch_is_retried_per_email(isolated_store):
+    batch = [queued_email("a", ["one"]), queued_email("b", ["bad"]), queued_email("c", ["two"])]
+    asyncio.run(email_webhook.store_batch_with_retry(batch))
+
+    assert RecordingEmbeddingModel.calls == [["one"], ["two"]]
+    assert pending_ids() == ["a", "c"]
+    assert index_writer.get_index_writer().bg.ntotal == 2
+
+def test_metadata_is_committed_only_after_a_snapshot(isolated_store, metadata_db, monkeypatch):
+    asyncio.run(email_webhook.store_batch_with_retry([queued_email("a", ["one"])]))
+    writer = index_writer.get_index_writer()
+
+    def failing_snapshot():
+        raise OSError("disk full")
+
+    with monkeypatch.context() as m:
+        m.setattr(writer, "snapshot", failing_snapshot)
+        asyncio.run(email_webhook.persist_index(metadata_db))
+    assert stored_ids(isolated_store) == []
+    assert pending_ids() == ["a"]
+
+    asyncio.run(email_webhook.persist_index(metadata_db))
+    assert stored_ids(isolated_store) == ["a"]
+    assert pending_ids() == []
+    assert IndexWriter(writer.index_path, str(isolated_store / "chunks.db")).bg.ntotal == 1
+
+def test_drain_pipeline_finishes_acknowledged_work(isolated_store, monkeypatch):
+    async def scenario():
+        monkeypatch.setattr(email_webhook, "index_queue", asyncio.Queue())
+        monkeypatch.setattr(email_webhook, "MAX_WAIT_MS", 10)
+        batcher = asyncio.create_task(email_webhook.run_index_batcher())
+
+        async def late_notification():
+            await asyncio.sleep(0.05)
+            await email_webhook.index_queue.put(queued_email("late", ["late chunk"]))
+
+        task = asyncio.create_task(late_notification())
+        email_webhook.notification_tasks.add(task)
+        task.add_done_callback(email_webhook.notification_tasks.discard)
+        await email_webhook.index_queue.put(queued_email("early", ["early chunk"]))
+
+        persister = asyncio.create_task(email_webhook.run_index_persister())
+        await email_webhook.drain_pipeline()
+        batcher.cancel()
+        await email_webhook.stop_index_persister(persister)
+        return email_webhook.index_queue.empty()
+
+    assert asyncio.run(scenario())
+    assert email_webhook.accepting_notifications is False
+    assert sorted(stored_ids(isolated_store)) == ["early", "late"]
+
+def test_html_to_text_reads_body_text():
+    assert email_webhook.html_to_text("<html><body><p>Hello</p><p>world</p></body></html>").split() == ["Hello", "world"]
+
+def test_html_to_text_handles_pages_without_body():
+    frameset = "<html><head><title>Frames</title></head><frameset><frame src='a.html'></frameset></html>"
+    assert email_webhook.html_to_text(frameset).strip() == "Frames"
+    assert email_webhook.html_to_text("") == ""
+
+class RecordingChunker:
+    async def chunk(self, text):
+        return [{"content": text, "metadata": {}}]
+
+@pytest.mark.parametrize("content_type, content, expected", [
+    ("text", "Plain <b>kept</b> as is", "Plain <b>kept</b> as is"),
+    ("html", "<html><body><p>Rendered</p></body></html>", "Rendered"),
+])
+def test_body_is_parsed_as_html_only_when_graph_returns_html(monkeypatch, content_type, content, expected):
+    monkeypatch.setattr(email_webhook, "chunker", RecordingChunker())
+    message = GraphEmailMsg(id="m1", body=ItemBody(contentType=content_type, content=content))
+
+    async def scenario():
+        monkeypatch.setattr(email_webhook, "index_queue", asyncio.Queue())
+        await email_webhook.process_and_store_email(message)
+        return email_webhook.index_queue.get_nowait()
+
+    chunks, metadata_entry = asyncio.run(scenario())
+    assert chunks[0]["content"].strip() == expected
+    assert chunks[0]["metadata"]["email_id"] == "m1"
+    assert metadata_entry["chunk_count"] == 1
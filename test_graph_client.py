@@ -0,0 +1,32 @@
+import asyncio
+import threading
+import time
+
+import graph_client
+
+class CountingMsalApp:
+    def __init__(self):
+        self.calls = 0
+        self.threads = set()
+
+    def acquire_token_silent(self, scopes, account):
+        return None
+
+    def acquire_token_for_client(self, scopes):
+        self.calls += 1
+        self.threads.add(threading.get_ident())
+        time.sleep(0.05)
+        return {"access_token": f"token-{self.calls}", "expires_in": 3600}
+
+def test_concurrent_callers_share_one_refresh(monkeypatch):
+    app = CountingMsalApp()
+    monkeypatch.setattr(graph_client, "get_msal_app", lambda: app)
+    monkeypatch.setattr(graph_client, "_TOKEN_CACHE", {})
+    monkeypatch.setattr(graph_client, "_TOKEN_LOCK", asyncio.Lock())
+
+    async def scenario():
+        return await asyncio.gather(*(graph_client.get_graph_token() for _ in range(5)))
+
+    assert asyncio.run(scenario()) == ["token-1"] * 5
+    assert app.calls == 1
+    assert threading.get_ident() not in app.threads
@@ -0,0 +1,25 @@
+import msgspec
+
+from graph_models import GraphEmailMsg, NotificationCollection
+
+def test_message_with_null_fields_decodes_with_defaults():
+    payload = b'''{
+        "id": "AAMk1",
+        "subject": null,
+        "sentDateTime": null,
+        "from": {"emailAddress": {"address": "a@example.com", "name": "A"}},
+        "ccRecipients": [{"emailAddress": {"address": "b@example.com"}}, {"emailAddress": {}}],
+        "body": {"contentType": "html", "content": "<p>Hi</p>"},
+        "unexpectedField": 1
+    }'''
+    msg = msgspec.json.decode(payload, type=GraphEmailMsg)
+
+    assert msg.sentDateTime is None
+    assert msg.subject is None
+    assert msg.from_.emailAddress.address == "a@example.com"
+    assert [r.emailAddress.address for r in msg.ccRecipients] == ["b@example.com", None]
+    assert msg.hasAttachments is False
+
+def test_notification_collection_reads_resources():
+    body = msgspec.json.decode(b'{"value": [{"resource": "users/1/messages/2", "clientState": "x"}]}', type=NotificationCollection)
+    assert [n.resource for n in body.value] == ["users/1/messages/2"]
@@ -0,0 +1,164 @@
+import json
+
+import numpy as np
+import faiss
+import pytest
+
+import index_writer
+from index_writer import IndexWriter
+from chunk_store import open_chunk_db, insert_chunks, fetch_chunks
+from metadata_store import open_metadata_db, insert_metadata
+
+DIM = 32
+
+def make_vectors(n, seed=0):
+    rng = np.random.default_rng(seed)
+    vectors = rng.normal(size=(n, DIM)).astype("float32")
+    faiss.normalize_L2(vectors)
+    return vectors
+
+def make_chunks(start, n):
+    return [{"content": f"chunk {i}", "metadata": {"email_id": f"email-{i // 10}"}} for i in range(start, start + n)]
+
+def metadata_entry(email_id):
+    return {
+        "email_id": email_id,
+        "subject": "Subject",
+        "sender": "a@example.com",
+        "sender_name": "A",
+        "timestamp": "20260101_000000",
+        "cc": ["b@example.com"],
+        "hasAttachments": False,
+        "chunk_count": 1,
+        "index_path": "index_email_ids.faiss",
+        "uploadDate": "2026-01-01T00:00:00"
+    }
+
+@pytest.fixture
+def paths(tmp_path):
+    return str(tmp_path / "index.faiss"), str(tmp_path / "chunks.db")
+
+@pytest.fixture(autouse=True)
+def small_thresholds(monkeypatch):
+    monkeypatch.setattr(index_writer, "IVF_THRESHOLD", 2000)
+    monkeypatch.setattr(index_writer, "INDEX_SWAP_ADDS", 500)
+
+def stored_chunk(writer, vector):
+    writer.swap()
+    return writer.search(vector[None, :], k=1)[0][0][0]
+
+def test_add_switches_to_ivf_and_searches(paths):
+    writer = IndexWriter(*paths)
+    vectors = make_vectors(3000)
+    writer.add(vectors[:3], make_chunks(0, 3))
+    for start in range(3, 3000, 400):
+        writer.add(vectors[start:start + 400], make_chunks(start, len(vectors[start:start + 400])))
+    writer.swap()
+
+    assert isinstance(writer.bg, faiss.IndexIVFScalarQuantizer)
+    assert writer.fg.ntotal == 3000
+    results = writer.search(vectors[[5, 2500]], k=1, nprobe=writer.bg.nlist)
+    assert results[0][0][0]["content"] == "chunk 5"
+    assert results[1][0][0]["content"] == "chunk 2500"
+
+def test_snapshot_and_reload_round_trip(paths):
+    writer = IndexWriter(*paths)
+    vectors = make_vectors(2500)
+    writer.add(vectors[:2200], make_chunks(0, 2200))
+    writer.snapshot()
+
+    reloaded = IndexWriter(*paths)
+    assert reloaded.bg.ntotal == 2200
+    assert reloaded.next_id == 2200
+    assert reloaded.search(vectors[[7]], k=1, nprobe=reloaded.bg.nlist)[0][0][0]["content"] == "chunk 7"
+
+    reloaded.add(vectors[2200:], make_chunks(2200, 300))
+    reloaded.swap()
+    assert reloaded.search(vectors[[2300]], k=1, nprobe=reloaded.bg.nlist)[0][0][0]["content"] == "chunk 2300"
+
+def test_reload_reuses_ids_not_in_last_snapshot(paths):
+    writer = IndexWriter(*paths)
+    vectors = make_vectors(20)
+    writer.add(vectors[:10], make_chunks(0, 10))
+    writer.snapshot()
+    # Simulates a crash: chunk rows for ids 10-19 are written but the index snapshot never is
+    writer.add(vectors[10:], make_chunks(10, 10))
+
+    reloaded = IndexWriter(*paths)
+    assert reloaded.next_id == 10
+    reloaded.add(vectors[10:11], [{"content": "replacement", "metadata": {}}])
+    assert stored_chunk(reloaded, vectors[10])["content"] == "replacement"
+
+def test_empty_add_is_a_no_op(paths):
+    writer = IndexWriter(*paths)
+    writer.add(np.empty((0, DIM), dtype="float32"), [])
+    assert writer.bg is None
+    writer.snapshot()
+
+def test_ivf_recall_after_small_first_batch(paths):
+    # Training happens on real float32 vectors, so a tiny first batch must not hurt recall
+    rng = np.random.default_rng(1)
+    scale = np.ones(DIM, dtype="float32")
+    scale[:4] = 8
+    vectors = (rng.normal(size=(4000, DIM)) * scale).astype("float32")
+    faiss.normalize_L2(vectors)
+
+    writer = IndexWriter(*paths)
+    writer.add(vectors[:3], make_chunks(0, 3))
+    writer.add(vectors[3:], make_chunks(3, 3997))
+    writer.swap()
+
+    exact = faiss.IndexFlatIP(DIM)
+    exact.add(vectors)
+    _, expected = exact.search(vectors[:100], 10)
+    _, found = writer.fg.search(vectors[:100], 10, params=faiss.SearchParametersIVF(nprobe=writer.fg.nlist))
+    recall = np.mean([len(set(a) & set(b)) / 10 for a, b in zip(expected, found)])
+    assert recall >= 0.95
+
+def test_searches_see_adds_only_after_swap(paths, monkeypatch):
+    monkeypatch.setattr(index_writer, "INDEX_SWAP_ADDS", 10_000)
+    writer = IndexWriter(*paths)
+    vectors = make_vectors(10)
+    writer.add(vectors, make_chunks(0, 10))
+    assert writer.search(vectors[:1]) == [[]]
+
+    writer.swap()
+    assert writer.search(vectors[:1], k=1)[0][0][0]["content"] == "chunk 0"
+
+def test_load_rejects_index_without_ids(paths):
+    index_path, db_path = paths
+    faiss.write_index(faiss.IndexFlatIP(DIM), index_path)
+    with pytest.raises(ValueError):
+        IndexWriter(index_path, db_path)
+
+def test_chunk_payloads_round_trip(paths):
+    _, db_path = paths
+    conn = open_chunk_db(db_path)
+    insert_chunks(conn, [1, 2], make_chunks(1, 2))
+    insert_chunks(conn, [2], [{"content": "replaced", "metadata": {}}])
+    chunks = fetch_chunks(conn, [1, 2, 3])
+    assert chunks[1]["content"] == "chunk 1"
+    assert chunks[2]["content"] == "replaced"
+    assert 3 not in chunks
+
+def test_duplicate_metadata_is_ignored(tmp_path):
+    conn = open_metadata_db(str(tmp_path / "metadata.db"))
+    assert insert_metadata(conn, [metadata_entry("a"), metadata_entry("b")]) == 2
+    assert insert_metadata(conn, [metadata_entry("b"), metadata_entry("c")]) == 1
+    assert insert_metadata(conn, [metadata_entry("c"), metadata_entry("c")]) == 0
+    assert conn.execute("SELECT COUNT(*) FROM metadata").fetchone()[0] == 3
+
+def test_legacy_metadata_json_is_imported_once(tmp_path):
+    legacy_path = tmp_path / "metadata.json"
+    legacy_path.write_text(json.dumps([metadata_entry("old-1"), metadata_entry("old-2")]))
+    db_path = str(tmp_path / "metadata.db")
+
+    conn = open_metadata_db(db_path, str(legacy_path))
+    assert [row[0] for row in conn.execute("SELECT email_id FROM metadata ORDER BY rowid")] == ["old-1", "old-2"]
+    assert json.loads(conn.execute("SELECT cc FROM metadata").fetchone()[0]) == ["b@example.com"]
+
+    conn.execute("DELETE FROM metadata WHERE email_id = 'old-2'")
+    conn.commit()
+    legacy_path.write_text(json.dumps([metadata_entry("old-3")]))
+    reopened = open_metadata_db(db_path, str(legacy_path))
+    assert [row[0] for row in reopened.execute("SELECT email_id FROM metadata")] == ["old-1"]